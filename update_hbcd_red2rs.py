@@ -1,9 +1,34 @@
 import os
+import re
 import shutil
-import json
-from git import Repo, exc as git_exc
+import functools
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import namedtuple
+from operator import attrgetter
+from io import BytesIO
+from git import Repo, Actor, PushInfo, exc as git_exc
+from git.objects import TagObject
+from git.objects.util import altz_to_utctz_str
+from git.refs.tag import TagReference
+from gitdb import IStream
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional, the stdlib parser accepts bytes too
+    from json import loads as json_loads
 import yaml
-from subprocess import run, CalledProcessError
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader, SafeDumper
+from subprocess import run
+try:
+    from reproschema.redcap2reproschema import redcap2reproschema
+except ImportError:  # reproschema-py is not importable here, use its command line instead
+    redcap2reproschema = None
 
 # Configurations
 input_dir = 'path/input_dir'
@@ -11,50 +36,97 @@ yaml_file_path = 'path/hbcd-redcap2rs/hbcd_redcap2rs.yaml'
 repo_path = 'path/hbcd-redcap2rs'  # Use the test repository path
 dry_run = False  # Set this to False when you are confident in the script
 
-# Initialize repository
-repo = Repo(repo_path)
+# Initialize repository; a dry run never opens it
+repo = None if dry_run else Repo(repo_path)
+
+_REVID_RE = re.compile(r'revid(\d+)')
+
+# e.g. HBCD_2024-01-15_123456_DataDictionary_revid147_rev3.csv or HBCD_2024-01-15_123456_revid147_rev3.csv
+_CSV_FILENAME_RE = re.compile(r'^[^_]+_(\d{4})-(\d{2})-(\d{2})_(\d{6})_(?:.*_)?revid(\d+)_rev(\d+)\.csv$')
+
+CsvEntry = namedtuple('CsvEntry', ['revid', 'rev', 'date_time_str', 'tag_name', 'path'])
+
+def _parse_csv_filename(filename):
+    """Parse a data dictionary filename into a CsvEntry, or return None if it does not match."""
+    match = _CSV_FILENAME_RE.match(filename)
+    if match is None:
+        return None
+    year, month, day, time_str, revid, rev = match.groups()
+    return CsvEntry(
+        int(revid),
+        int(rev),
+        f"{year}-{month}-{day}_{time_str}",
+        f"{year}.{month}.{day}.{time_str}",
+        os.path.join(input_dir, filename),
+    )
+
+def parse_revid(value):
+    """Return the integer revid contained in a string such as 'revid147', or 0 if there is none."""
+    match = _REVID_RE.search(value)
+    return int(match.group(1)) if match else 0
 
 def get_latest_tag_version(repo, protocol_name):
     """Retrieve the latest tag version from the repository based on tag names and read the schema file."""
-    tags = sorted(repo.tags, key=lambda t: t.name)
-    
-    # Print the sorted tag names for debugging purposes
-    for tag in tags:
-        print(f"Tag: {tag.name}")
-    
-    if tags:
-        # The latest tag is the last one in the sorted list
-        latest_tag = tags[-1]
-        print(f"Latest Tag: {latest_tag.name}")  # Debugging print
-        
-        # Get the commit associated with the latest tag
-        commit = latest_tag.commit
-        
-        # Retrieve the schema file content from the commit
-        schema_file_path = f"{protocol_name}/{protocol_name}_schema"
-        try:
-            schema_content = (commit.tree / schema_file_path).data_stream.read().decode('utf-8')
-            schema_data = json.loads(schema_content)
-            version_str = schema_data.get('version', 'revid0')
-            return int(version_str.replace('revid', ''))
-        except KeyError:
-            print(f"Schema file {schema_file_path} not found in the latest tag {latest_tag.name}")
-            return 0
-        except Exception as e:
-            print(f"Error reading schema file {schema_file_path} from the latest tag {latest_tag.name}: {e}")
-            return 0
-    return 0
-
-def update_repo(output_folder, folders_to_update, repo_path):
-    """Move specific folders from output folder to the repository."""
-    for folder in folders_to_update:
-        dest_path = os.path.join(repo_path, folder)
-        src_path = os.path.join(output_folder, folder)
+    if not repo.head.is_valid():
+        return 0  # No commits yet, so nothing has been converted
+    return _latest_tag_version(repo, repo.head.commit.hexsha, protocol_name)
+
+@functools.lru_cache(maxsize=1)
+def _latest_tag_version(repo, head_hexsha, protocol_name):
+    """Cached body of get_latest_tag_version, keyed on the HEAD commit so new commits invalidate it."""
+    # Let git pick the newest date-based tag (e.g. 2024.01.15.123456) instead of loading every Tag object
+    latest_tag = repo.git.for_each_ref(
+        '--sort=-version:refname', '--count=1', '--format=%(refname:short)', 'refs/tags/'
+    ).strip()
+    if not latest_tag:
+        return 0
+    print(f"Latest Tag: {latest_tag}")  # Debugging print
+
+    # Get the commit associated with the latest tag
+    commit = repo.commit(latest_tag)
+
+    # Retrieve the schema file content from the commit
+    schema_file_path = f"{protocol_name}/{protocol_name}_schema"
+    try:
+        schema_data = json_loads(commit.tree[schema_file_path].data_stream.read())
+        return parse_revid(schema_data.get('version', 'revid0'))
+    except KeyError:
+        print(f"Schema file {schema_file_path} not found in the latest tag {latest_tag}")
+        return 0
+    except Exception as e:
+        print(f"Error reading schema file {schema_file_path} from the latest tag {latest_tag}: {e}")
+        return 0
+
+def get_working_tree_version(protocol_name):
+    """Read the version from the schema file checked out in repo_path, without opening the git repository."""
+    schema_file_path = os.path.join(repo_path, protocol_name, f"{protocol_name}_schema")
+    try:
+        with open(schema_file_path, 'rb') as f:
+            schema_data = json_loads(f.read())
+        return parse_revid(schema_data.get('version', 'revid0'))
+    except FileNotFoundError:
+        print(f"Schema file {schema_file_path} not found")
+        return 0
+    except Exception as e:
+        print(f"Error reading schema file {schema_file_path}: {e}")
+        return 0
+
+def update_repo(folder_moves):
+    """Move specific folders from output folder to the repository, given as (src_path, dest_path) pairs."""
+    for src_path, dest_path in folder_moves:
         if dry_run:
             print(f"Would move {src_path} to {dest_path}")
         else:
-            if os.path.exists(dest_path):
-                shutil.rmtree(dest_path)  # Remove existing folder in destination (optional)
+            # Swap the existing folder out with a rename and delete it off the critical path
+            trash_path = os.path.join(
+                os.path.dirname(dest_path), f".{os.path.basename(dest_path)}.old-{uuid.uuid4().hex}"
+            )
+            try:
+                os.rename(dest_path, trash_path)
+            except FileNotFoundError:
+                pass  # Nothing to replace yet
+            else:
+                threading.Thread(target=shutil.rmtree, args=(trash_path,)).start()
                 print(f"Removed existing folder {dest_path}")
             try:
                 os.rename(src_path, dest_path)  # Attempt atomic move
@@ -62,127 +134,332 @@ def update_repo(output_folder, folders_to_update, repo_path):
             except OSError as e:
                 print(f"Move failed for {src_path}: {e}")
 
-def is_version_only_change(file_path, repo):
-    """Check if the only change in the file is the 'version' field."""
-    with open(file_path, 'r') as f:
-        working_content = json.load(f)
+# GitPython serves blobs through one persistent `git cat-file` process, which is not thread-safe
+_odb_lock = threading.Lock()
+
+_VERSION_FIELD_RE = re.compile(rb'"version"\s*:\s*"revid\d+"')
+
+def is_version_only_change(file_path, a_path, head_tree):
+    """Check if the only change in the file is the 'version' field; None if the file is new or unchanged."""
+    with open(file_path, 'rb') as f:
+        working_data = f.read()
+    # Git's blob id, so unchanged files are recognised without reading the blob
+    working_sha = hashlib.sha1(b"blob %d\0" % len(working_data) + working_data).digest()
+    
+    with _odb_lock:
+        try:
+            blob = head_tree / a_path
+        except KeyError:
+            return None  # New file, there is nothing to revert to
+        if blob.binsha == working_sha:
+            return None  # Unchanged, so there is nothing to revert
+        last_commit_data = blob.data_stream.read()
     
-    last_commit_content = repo.git.show(f'HEAD:{file_path}')
-    last_commit_content = json.loads(last_commit_content)
+    # Blank out the version field and compare the remaining bytes directly
+    working_canonical, working_count = _VERSION_FIELD_RE.subn(b'"version": ""', working_data)
+    last_commit_canonical, last_commit_count = _VERSION_FIELD_RE.subn(b'"version": ""', last_commit_data)
+    if working_count == 1 and last_commit_count == 1:
+        return working_canonical == last_commit_canonical
+    
+    # No single version field to blank out, fall back to comparing the parsed JSON
+    try:
+        working_content = json_loads(working_data)
+        last_commit_content = json_loads(last_commit_data)
+    except ValueError:
+        return False  # Not a JSON document, so not a version-only change
     
     working_version = working_content.pop("version", None)
     last_commit_version = last_commit_content.pop("version", None)
     
     return working_content == last_commit_content and working_version != last_commit_version
 
-def process_changed_files():
-    """Process changed files and discard changes if only 'version' is modified."""
-    repo.git.add(update=True)  # Ensure index is up to date
-    for item in repo.index.diff(None):  # None means comparing working directory against HEAD
-        if item.change_type == 'M' and item.a_path.endswith('.json'):
-            file_path = os.path.join(repo_path, item.a_path)
-            if is_version_only_change(file_path, repo):
-                if dry_run:
-                    print(f"Would checkout {file_path}")
-                else:
-                    repo.git.checkout(file_path)
-                    print(f"Checkout {file_path}")
-            else:
-                print(f"{file_path} has more changes than version")
+def find_version_only_changes(folder_moves, protocol_schema_path):
+    """Return the repository paths of staged files, given as (src_path, dest_path) folder pairs, where only 'version' differs from HEAD.
 
-def commit_and_tag(commit_message, tag_name, tag_message, folders_to_update):
+    The staged output is compared before it is moved into the repository, so this can run while it is validated.
+    protocol_schema_path is never reverted: its version is how the next run finds the latest converted revid.
+    """
+    if dry_run:
+        print("Would discard changes to schema files where only 'version' is modified")
+        return []
+    if not repo.head.is_valid():
+        return []  # No commits yet, so there is nothing to revert to
+    head_tree = repo.head.commit.tree  # Resolve HEAD once for all files
+    # Schema files have no extension, so every staged file under the update folders is a candidate
+    candidates = []
+    for src_path, dest_path in folder_moves:
+        for dir_path, _, file_names in os.walk(src_path):
+            rel_dir = os.path.relpath(os.path.join(dest_path, os.path.relpath(dir_path, src_path)), repo_path)
+            for file_name in file_names:
+                a_path = os.path.normpath(os.path.join(rel_dir, file_name)).replace(os.sep, '/')
+                if a_path != protocol_schema_path:
+                    candidates.append((os.path.join(dir_path, file_name), a_path))
+    
+    # The comparisons are independent and mostly file I/O, so run them concurrently
+    paths_to_revert = []
+    with ThreadPoolExecutor(max_workers=min(16, (os.cpu_count() or 1) * 4)) as executor:
+        only_version_flags = executor.map(
+            lambda candidate: is_version_only_change(candidate[0], candidate[1], head_tree),
+            candidates,
+        )
+        for (file_path, a_path), only_version in zip(candidates, only_version_flags):
+            if only_version:
+                paths_to_revert.append(a_path)
+                print(f"Checkout {os.path.join(repo_path, a_path)}")
+            elif only_version is not None:
+                print(f"{os.path.join(repo_path, a_path)} has more changes than version")
+    return paths_to_revert
+
+def revert_files(paths_to_revert):
+    """Discard the changes to the given repository paths."""
+    if paths_to_revert and not dry_run:
+        repo.git.checkout('HEAD', '--', *paths_to_revert)  # Restore both index and working tree
+
+def run_redcap2reproschema(csv_file_path, yaml_path, output_path):
+    """Convert a CSV data dictionary, in-process when reproschema-py is importable."""
+    if redcap2reproschema is not None:
+        redcap2reproschema(csv_file_path, yaml_path, output_path)
+    else:
+        command = [
+            "reproschema",
+            "redcap2reproschema",
+            csv_file_path,
+            yaml_path,
+            "--output-path",
+            output_path
+        ]
+        run(command, check=True)
+
+def create_annotated_tag(tag_name, tag_message):
+    """Create an annotated tag for HEAD by writing the tag object and its ref in-process, instead of `git tag -m`."""
+    tag_ref = TagReference(repo, f"refs/tags/{tag_name}")
+    if tag_ref.is_valid():
+        raise ValueError(f"Tag {tag_name} already exists")
+    tagger = Actor.committer(repo.config_reader())
+    utc_offset = time.altzone if time.localtime().tm_isdst > 0 else time.timezone
+    tag_data = (
+        f"object {repo.head.commit.hexsha}\n"
+        f"type commit\n"
+        f"tag {tag_name}\n"
+        f"tagger {tagger.name} <{tagger.email}> {int(time.time())} {altz_to_utctz_str(utc_offset)}\n"
+        f"\n"
+        f"{tag_message}\n"
+    ).encode('utf-8')
+    istream = repo.odb.store(IStream(TagObject.type, len(tag_data), BytesIO(tag_data)))
+    tag_ref.set_reference(TagObject(repo, istream.binsha))
+    return tag_ref
+
+def commit_and_tag(commit_message, tag_name, tag_message, folder_paths):
     """Commit changes and create a tag with a message, including only specified folders."""
-    # Stage only specific folders
-    for folder in folders_to_update:
-        folder_path = os.path.join(repo_path, folder)
-        if os.path.exists(folder_path):
-            repo.git.add(folder_path)
+    # Stage only specific folders, all in one git invocation; one directory listing
+    # tells which of them exist instead of a stat per folder
+    with os.scandir(repo_path) as it:
+        repo_entries = {entry.name for entry in it}
+    paths_to_add = []
+    for folder_path in folder_paths:
+        if os.path.basename(folder_path) in repo_entries:
+            paths_to_add.append(folder_path)
         else:
             print(f"Folder {folder_path} does not exist and will not be added.")
     
     if dry_run:
+        print(f"Would stage {', '.join(paths_to_add)}")
         print(f"Would commit with message: {commit_message}")
         print(f"Would tag with name: {tag_name} and message: {tag_message}")
     else:
+        # Refuse before committing, so an existing tag cannot leave an untagged duplicate commit behind
+        if TagReference(repo, f"refs/tags/{tag_name}").is_valid():
+            raise ValueError(f"Tag {tag_name} already exists")
+        repo.git.add(update=True)  # Tracked changes outside the folders, such as the YAML file
+        if paths_to_add:
+            repo.git.add('--', *paths_to_add)
         repo.index.commit(commit_message)
-        repo.create_tag(tag_name, message=tag_message)
-        origin = repo.remote(name='origin')
-        try:
-            origin.push(tag_name)
-            origin.push()
-        except git_exc.GitCommandError:
-            origin.push(force=True)
+        create_annotated_tag(tag_name, tag_message)
         print(f"***************************\nGit tagged {tag_name}\n***************************")
 
+# GitPython reports rejected refs through PushInfo flags instead of raising
+_PUSH_FAILED = PushInfo.ERROR | PushInfo.REJECTED | PushInfo.REMOTE_REJECTED | PushInfo.REMOTE_FAILURE
+
+def _push(origin, *args, **kwargs):
+    """Push to origin and return True only if the command succeeded and no ref was rejected."""
+    try:
+        infos = origin.push(*args, **kwargs)
+    except git_exc.GitCommandError as e:
+        print(f"Push failed: {e}")
+        return False
+    failed = [info for info in infos if info.flags & _PUSH_FAILED]
+    for info in failed:
+        print(f"Push of {info.remote_ref_string} failed: {info.summary.strip()}")
+    return bool(infos) and not failed
+
+def push_changes(created_tags):
+    """Push the current branch and all tags created in this run with a single atomic push."""
+    if not created_tags:
+        return
+    if dry_run:
+        print(f"Would push the current branch and tags: {', '.join(created_tags)}")
+        return
+    origin = repo.remote(name='origin')
+    if repo.head.is_detached:
+        print("HEAD is detached, pushing only the new tags")
+        branch_refspecs = []
+    else:
+        branch_refspecs = [f"refs/heads/{repo.active_branch.name}"]
+    if _push(origin, refspec=branch_refspecs + [f"refs/tags/{t}" for t in created_tags], atomic=True):
+        return
+    # Fall back to pushing the tags one by one and forcing the branch
+    for tag_name in created_tags:
+        _push(origin, f"refs/tags/{tag_name}")
+    if branch_refspecs:
+        _push(origin, branch_refspecs[0], force=True)
+
+def stage_conversion(entry, yaml_content, stage_dir):
+    """Convert one CSV entry into its own staging directory; runs in a worker process."""
+    os.makedirs(stage_dir)
+    stage_yaml_path = os.path.join(stage_dir, os.path.basename(yaml_file_path))
+    with open(stage_yaml_path, 'w') as f:
+        yaml.dump(dict(yaml_content, redcap_version=f"revid{entry.revid}"), f, Dumper=SafeDumper)
+    run_redcap2reproschema(entry.path, stage_yaml_path, stage_dir)
+
+def validate_stage(output_folder):
+    """Validate converted output with reproschema before it goes anywhere near the repository."""
+    run(["reproschema", "validate", output_folder], check=True)
+
+def convert_files(files_to_convert, yaml_content, absolute_dir, folders_to_update, folder_paths, current_version):
+    """Convert each parsed CSV entry, move the result into the repository, then commit and tag it.
+
+    Conversion runs in worker processes, each into its own staging directory, while the git work stays
+    in this process and handles the entries one at a time in order. Each entry's output is compared
+    against HEAD while reproschema validates it, and is moved in only once it is valid. yaml_content and
+    current_version are kept in memory and updated as each entry is committed; the latest committed
+    version is returned. The branch and the new tags are pushed once at the end, even if an entry fails.
+    """
+    protocol_name = yaml_content['protocol_name']
+    created_tags = []
+    stage_dirs = [os.path.join(absolute_dir, f"_stage_revid{e.revid}_rev{e.rev}") for e in files_to_convert]
+    executor = validator = None
+    if not dry_run:
+        executor = ProcessPoolExecutor(max_workers=min(len(files_to_convert), os.cpu_count() or 1))
+        # Validation is a subprocess; its own thread keeps it from queueing behind later conversions
+        validator = ThreadPoolExecutor(max_workers=1)
+    try:
+        futures = []
+        for entry, stage_dir in zip(files_to_convert, stage_dirs):
+            if dry_run:
+                print(f"Would convert {entry.path} into {stage_dir}")
+                futures.append(None)
+            else:
+                shutil.rmtree(stage_dir, ignore_errors=True)  # Left over from an interrupted run
+                futures.append(executor.submit(stage_conversion, entry, yaml_content, stage_dir))
+
+        for entry, stage_dir, future in zip(files_to_convert, stage_dirs, futures):
+            output_folder = os.path.join(stage_dir, protocol_name)
+            folder_moves = [
+                (os.path.join(output_folder, folder), folder_path)
+                for folder, folder_path in zip(folders_to_update, folder_paths)
+            ]
+            validation = None
+            if future is None:
+                print(f"Would validate {output_folder} using reproschema")
+            else:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error running reproschema on {entry.path}: {e}")
+                    break
+                validation = validator.submit(validate_stage, output_folder)
+
+            # Classify the staged files against HEAD while validation runs
+            paths_to_revert = find_version_only_changes(folder_moves, f"{protocol_name}/{protocol_name}_schema")
+            if validation is not None:
+                try:
+                    validation.result()
+                except Exception as e:
+                    print(f"Error validating {output_folder}: {e}")
+                    break
+
+            redcap_version = f"revid{entry.revid}"
+            if yaml_content.get('redcap_version') == redcap_version:
+                print(f"YAML already has redcap_version: {redcap_version}")
+            elif dry_run:
+                yaml_content['redcap_version'] = redcap_version
+                print(f"Would update YAML with redcap_version: {redcap_version}")
+            else:
+                yaml_content['redcap_version'] = redcap_version
+                with open(yaml_file_path, 'w') as f:
+                    yaml.dump(yaml_content, f, Dumper=SafeDumper)
+
+            update_repo(folder_moves)
+            revert_files(paths_to_revert)
+            date_time_str = entry.date_time_str
+            commit_message = f"converted hbcd redcap data dictionary {date_time_str} to reproschema"
+            tag_message = f"redcap data dictionary {date_time_str} to reproschema"
+
+            commit_and_tag(commit_message, entry.tag_name, tag_message, folder_paths)
+            created_tags.append(entry.tag_name)
+            current_version = entry.revid
+    except Exception:
+        # Entries committed before the failure are pushed too, then the error propagates unchanged
+        try:
+            push_changes(created_tags)
+        except Exception as push_error:
+            print(f"Push after failure did not complete: {push_error}")
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+            validator.shutdown()
+            for stage_dir in stage_dirs:
+                shutil.rmtree(stage_dir, ignore_errors=True)
+    # Reached after the loop or a failed conversion, so whatever was committed is pushed
+    push_changes(created_tags)
+    return current_version
+
 def main():
     absolute_dir = os.path.abspath(input_dir)
     
     with open(yaml_file_path, 'r') as f:
-        yaml_content = yaml.safe_load(f)
+        yaml_content = yaml.load(f, Loader=SafeLoader)
     
     protocol_name = yaml_content['protocol_name']
-    current_version = get_latest_tag_version(repo, protocol_name)
+    if dry_run:
+        # Skip opening the repository and reading tags; the checked-out schema is close enough for a preview
+        current_version = get_working_tree_version(protocol_name)
+    else:
+        current_version = get_latest_tag_version(repo, protocol_name)
     
-    # Determine sorting order based on current_version
-    ascending_order = current_version == 0
-    sorted_filenames = sorted(os.listdir(input_dir), reverse=not ascending_order)
+    # Filter in the same pass as the listing so only newer versions get sorted;
+    # revids below 101 are never converted
+    min_revid = max(current_version, 100)
+    entries = []
+    with os.scandir(input_dir) as it:
+        for dir_entry in it:
+            if not dir_entry.name.endswith('.csv') or not dir_entry.is_file(follow_symlinks=False):
+                continue
+            entry = _parse_csv_filename(dir_entry.name)
+            if entry is None:
+                print(f"Skipping {dir_entry.name}: file name does not match the data dictionary pattern")
+            elif entry.revid > min_revid:
+                entries.append(entry)
+    if not entries:
+        print(f"No newer version detected or revid is not greater than 101 (current revid{current_version})")
+        return
     
-    for filename in sorted_filenames:
-        if filename.endswith('.csv'):
-            parts = filename.split('_')
-            date_time_str = parts[1] + '_' + parts[2]
-            redcap_version = parts[-2].replace('revid', '')
-            
-            # Check only the latest version for subsequent runs
-            if current_version == 0 or (int(redcap_version) > current_version):
-                if int(redcap_version) >= 101:
-                    yaml_content['redcap_version'] = f"revid{redcap_version}"
-                    if dry_run:
-                        print(f"Would update YAML with redcap_version: {yaml_content['redcap_version']}")
-                    else:
-                        with open(yaml_file_path, 'w') as f:
-                            yaml.safe_dump(yaml_content, f)
-                    
-                    csv_file_path = os.path.join(input_dir, filename)
-                    if dry_run:
-                        print(f"Would convert {csv_file_path} using reproschema redcap2reproschema")
-                    else:
-                        command = [
-                            "reproschema",
-                            "redcap2reproschema",
-                            csv_file_path,
-                            yaml_file_path,
-                            "--output-path",
-                            absolute_dir
-                        ]
-                        try:
-                            run(command, check=True)
-                        except CalledProcessError as e:
-                            print(f"Error running reproschema redcap2reproschema: {e}")
-                            return
-                    
-                    output_folder = os.path.join(absolute_dir, protocol_name)
-                    if dry_run:
-                        print(f"Would validate {output_folder} using reproschema validate")
-                    else:
-                        try:
-                            run(["reproschema", "validate", output_folder], check=True)
-                        except CalledProcessError as e:
-                            print(f"Error running reproschema validate: {e}")
-                            return
-                    
-                    folders_to_update = [f"{protocol_name}", "activities"]  # Include only specific folders
-
-                    update_repo(output_folder, folders_to_update, repo_path)
-                    process_changed_files()
-                    commit_message = f"converted hbcd redcap data dictionary {date_time_str} to reproschema"
-                    tag_message = f"redcap data dictionary {date_time_str} to reproschema"
-                    tag_name = date_time_str.replace("-", ".").replace("_", ".")
-                    
-                    commit_and_tag(commit_message, tag_name, tag_message, folders_to_update)
-            else:
-                print(f"No newer version detected or revid is not greater than 101 for file: {filename}")
-                break  # Exit the loop if the latest version does not require an update
+    # Of several files sharing a revid only the latest rev (then date) is converted
+    entries.sort(key=attrgetter('revid', 'rev', 'date_time_str'))
+    latest_by_revid = {}
+    for entry in entries:
+        superseded = latest_by_revid.get(entry.revid)
+        if superseded is not None:
+            print(f"Skipping {superseded.path}: superseded by {entry.path}")
+        latest_by_revid[entry.revid] = entry
+    entries = list(latest_by_revid.values())
+    
+    # Build the folder paths once for the whole run
+    folders_to_update = [f"{protocol_name}", "activities"]  # Include only specific folders
+    folder_paths = [os.path.join(repo_path, folder) for folder in folders_to_update]
+    
+    convert_files(entries, yaml_content, absolute_dir, folders_to_update, folder_paths, current_version)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file